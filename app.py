@@ -1,12 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, make_response
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import raiseload, selectinload
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 import os
+import math
 import uuid
 import io
+import gzip
+import threading
+import time
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from dotenv import load_dotenv
 from PIL import Image, ImageOps
 
@@ -14,18 +23,28 @@ from PIL import Image, ImageOps
 load_dotenv()
 
 app = Flask(__name__)
+# Keep every compiled template in memory instead of the default LRU of 400
+app.jinja_options = {**app.jinja_options, 'cache_size': -1}
 # Require SECRET_KEY in production - no fallback to insecure default
 secret_key = os.environ.get('SECRET_KEY')
 if not secret_key:
     raise ValueError("SECRET_KEY environment variable must be set for production deployment")
 app.config['SECRET_KEY'] = secret_key
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///currency_exchange.db')
+# Database URL is read once and shared by the URI and engine option setup below
+database_url = os.environ.get('DATABASE_URL', 'sqlite:///currency_exchange.db')
+is_sqlite = 'sqlite' in database_url
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # File upload configuration
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max file size
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+# Suffix tuple for allowed_file, so one str.endswith call checks every extension
+ALLOWED_IMAGE_SUFFIXES = tuple('.' + ext for ext in app.config['ALLOWED_EXTENSIONS'])
+# Internal nginx location aliased to UPLOAD_FOLDER; when set, nginx streams
+# uploaded images itself via X-Accel-Redirect instead of the Flask worker
+UPLOADS_X_ACCEL_PREFIX = os.environ.get('UPLOADS_X_ACCEL_PREFIX', '')
 
 # Create upload directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -33,13 +52,10 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # SQLAlchemy configuration for better stability
 from sqlalchemy.pool import NullPool
 
-database_url = os.environ.get('DATABASE_URL', 'sqlite:///currency_exchange.db')
-is_sqlite = 'sqlite' in database_url
-
 if is_sqlite:
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        # Every checkout is a fresh connection, so there is nothing stale to pre-ping
         'poolclass': NullPool,
-        'pool_pre_ping': True,
         'connect_args': {
             'check_same_thread': False,
             'timeout': 60,
@@ -47,8 +63,15 @@ if is_sqlite:
         'echo': False
     }
 else:
+    # Keep connections open between requests instead of reconnecting every time.
+    # Sync gunicorn workers serve one request at a time, so a small pool per
+    # worker is enough; pre-ping and recycle guard against dropped connections,
+    # and LIFO checkout keeps reusing the warmest connection.
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        'poolclass': NullPool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_recycle': 1800,
+        'pool_use_lifo': True,
         'pool_pre_ping': True,
         'connect_args': {
             'connect_timeout': 60,
@@ -58,24 +81,37 @@ else:
 
 db = SQLAlchemy(app)
 
+if is_sqlite:
+    # WAL lets readers proceed while an admin write is in progress. journal_mode
+    # persists in the database file, so it is set once here; synchronous=NORMAL
+    # (commits no longer fsync the journal every time) is per connection.
+    with app.app_context():
+        @db.event.listens_for(db.engine, 'connect')
+        def _set_sqlite_synchronous(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+        
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+
 @app.teardown_appcontext
 def close_db_session(error):
-    """Ensure database sessions are properly closed after each request"""
-    try:
-        if error:
-            db.session.rollback()
-        else:
-            db.session.commit()
-        db.session.remove()
-    except Exception:
+    """Roll back after a failed request; write routes commit their own changes"""
+    # Flask-SQLAlchemy removes the session itself once this returns, discarding
+    # anything a request left uncommitted
+    if error:
         try:
-            db.session.remove()
+            db.session.rollback()
         except Exception:
             pass
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+# Identity is taken from the signed session cookie; load_user only confirms the
+# username still exists, answered from an in-process cache after the first hit
+login_manager.session_protection = 'basic'
 
 # Handle file upload errors
 @app.errorhandler(413)
@@ -90,6 +126,13 @@ def request_entity_too_large(error):
         flash('File size exceeds the 10MB limit. Please choose a smaller file.', 'error')
         return redirect(request.url or url_for('dashboard'))
 
+# Explicit password hashing parameters so the login cost does not drift with
+# library defaults; scrypt verifies in about half the time of pbkdf2:sha256:600000
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+# Checked against when a login names an unknown user, so failed logins cost the
+# same whether or not the username exists
+DUMMY_PASSWORD_HASH = generate_password_hash(uuid.uuid4().hex, method=PASSWORD_HASH_METHOD)
+
 class AdminUser(db.Model):
     __tablename__ = 'admin_users'
     
@@ -99,32 +142,66 @@ class AdminUser(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    @staticmethod
+    def password_needs_rehash(password_hash):
+        """Check if a stored hash was made with a different method or cost"""
+        return not password_hash.startswith(PASSWORD_HASH_METHOD + '$')
+    
     def __repr__(self):
         return f'<AdminUser {self.username}>'
 
 class User(UserMixin):
+    __slots__ = ('id', 'username')
+    
     def __init__(self, username):
         self.id = username
         self.username = username
 
+# Usernames known to exist in admin_users mapped to when that was last confirmed;
+# lets load_user skip the per-request SELECT. Entries expire so admin changes made
+# by other processes (e.g. migrations.py) are picked up within the TTL.
+ADMIN_USER_CACHE_TTL = 60
+_admin_username_cache = {}
+
+def cache_admin_username(username):
+    _admin_username_cache[username] = time.monotonic() + ADMIN_USER_CACHE_TTL
+
+@db.event.listens_for(AdminUser, 'after_insert')
+def _cache_admin_username(mapper, connection, target):
+    cache_admin_username(target.username)
+
+@db.event.listens_for(AdminUser, 'after_update')
+@db.event.listens_for(AdminUser, 'after_delete')
+def _reset_admin_username_cache(mapper, connection, target):
+    _admin_username_cache.clear()
+
 @login_manager.user_loader
 def load_user(user_id):
     if not user_id:
         return None
     
+    expires_at = _admin_username_cache.get(user_id)
+    if expires_at is not None and expires_at > time.monotonic():
+        return User(user_id)
+    
     try:
-        admin_user = AdminUser.query.filter_by(username=user_id).first()
-        if admin_user:
-            return User(admin_user.username)
+        # Only existence matters here, so fetch the username column instead of a full row
+        username = db.session.scalar(db.select(AdminUser.username).where(AdminUser.username == user_id))
+        if username:
+            cache_admin_username(username)
+            return User(username)
         return None
     except Exception:
         return None
 
+# Display format shared by every rate range shown to users
+RATE_RANGE_FORMAT = '%.6f - %.6f'
+
 class Currency(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -135,6 +212,30 @@ class Currency(db.Model):
     max_selling_rate_to_aed = db.Column(db.Float, nullable=True)
     admin_notes = db.Column(db.Text, nullable=True)
     notes_updated_at = db.Column(db.DateTime, nullable=True)
+    # Number of non-deleted images, filled in by list queries via with_expression
+    # so has_notes does not count each currency's images separately
+    active_image_count = db.query_expression()
+    # Upload time of the newest non-deleted image, loaded the same way by pages
+    # that show latest_note_timestamp
+    latest_image_uploaded_at = db.query_expression()
+    
+    # Relationships are loaded per query: list pages opt in with selectinload and
+    # the shared list query raises on anything else
+    images = db.relationship('NoteImage', back_populates='currency', cascade='all, delete-orphan')
+    # Non-deleted images only, as a query for counts and aggregates (viewonly to avoid conflicts)
+    active_images = db.relationship('NoteImage', lazy='dynamic', viewonly=True,
+                                    primaryjoin="and_(NoteImage.currency_id==Currency.id, NoteImage.deleted_at==None)")
+    history = db.relationship('CurrencyHistory', back_populates='currency',
+                              order_by='CurrencyHistory.created_at.desc()')
+    note_history = db.relationship('NoteHistory', back_populates='currency',
+                                   order_by='NoteHistory.created_at.desc()')
+    
+    # Rate ranges are validated in parse_rate_range; the database enforces the same
+    # invariant so it holds for every write path
+    __table_args__ = (
+        db.CheckConstraint('min_buying_rate_to_aed < max_buying_rate_to_aed', name='ck_currency_buying_range'),
+        db.CheckConstraint('min_selling_rate_to_aed < max_selling_rate_to_aed', name='ck_currency_selling_range'),
+    )
     
     def __repr__(self):
         return f'<Currency {self.symbol}: {self.name}>'
@@ -142,7 +243,12 @@ class Currency(db.Model):
     @property
     def has_notes(self):
         """Check if currency has any notes (text or images)"""
-        return bool(self.admin_notes) or self.active_images.count() > 0
+        if self.admin_notes:
+            return True
+        image_count = self.active_image_count
+        if image_count is None:
+            image_count = self.active_images.count()
+        return image_count > 0
     
     @property
     def latest_note_timestamp(self):
@@ -153,53 +259,82 @@ class Currency(db.Model):
         if self.notes_updated_at:
             timestamps.append(self.notes_updated_at)
         
-        # Add image timestamps (only non-deleted images)
-        for image in self.active_images.all():
-            if image.uploaded_at:
-                timestamps.append(image.uploaded_at)
+        # Add the newest image timestamp (only non-deleted images), letting the
+        # database pick it when the list query did not already load it (a loaded
+        # value may legitimately be None, so check for its presence instead)
+        if 'latest_image_uploaded_at' in self.__dict__:
+            latest_image = self.latest_image_uploaded_at
+        else:
+            latest_image = self.active_images.with_entities(db.func.max(NoteImage.uploaded_at)).scalar()
+        if latest_image:
+            timestamps.append(latest_image)
         
         return max(timestamps) if timestamps else None
     
-    @property
+    @cached_property
     def has_buying_range(self):
         return self.min_buying_rate_to_aed is not None and self.max_buying_rate_to_aed is not None
     
-    @property
+    @cached_property
     def has_selling_range(self):
         return self.min_selling_rate_to_aed is not None and self.max_selling_rate_to_aed is not None
     
-    @property
+    @cached_property
     def has_exchange_rates(self):
         return self.has_buying_range or self.has_selling_range
     
-    @property
+    @cached_property
     def buying_rate_display(self):
-        if self.has_buying_range:
-            return f"{self.min_buying_rate_to_aed:.6f} - {self.max_buying_rate_to_aed:.6f}"
+        min_rate, max_rate = self.min_buying_rate_to_aed, self.max_buying_rate_to_aed
+        if min_rate is not None and max_rate is not None:
+            return RATE_RANGE_FORMAT % (min_rate, max_rate)
         return "Not set"
     
-    @property
+    @cached_property
     def selling_rate_display(self):
-        if self.has_selling_range:
-            return f"{self.min_selling_rate_to_aed:.6f} - {self.max_selling_rate_to_aed:.6f}"
+        min_rate, max_rate = self.min_selling_rate_to_aed, self.max_selling_rate_to_aed
+        if min_rate is not None and max_rate is not None:
+            return RATE_RANGE_FORMAT % (min_rate, max_rate)
         return "Not set"
     
-    @property
+    @cached_property
     def buying_from_aed_display(self):
-        if self.has_selling_range:
-            min_rate = 1 / self.max_selling_rate_to_aed
-            max_rate = 1 / self.min_selling_rate_to_aed
-            return f"{min_rate:.6f} - {max_rate:.6f}"
+        min_rate, max_rate = self.min_selling_rate_to_aed, self.max_selling_rate_to_aed
+        if min_rate is not None and max_rate is not None:
+            return RATE_RANGE_FORMAT % (1 / max_rate, 1 / min_rate)
         return "Not set"
     
-    @property
+    @cached_property
     def selling_from_aed_display(self):
-        if self.has_buying_range:
-            min_rate = 1 / self.max_buying_rate_to_aed
-            max_rate = 1 / self.min_buying_rate_to_aed
-            return f"{min_rate:.6f} - {max_rate:.6f}"
+        min_rate, max_rate = self.min_buying_rate_to_aed, self.max_buying_rate_to_aed
+        if min_rate is not None and max_rate is not None:
+            return RATE_RANGE_FORMAT % (1 / max_rate, 1 / min_rate)
         return "Not set"
 
+    # Cached rate-derived values, dropped whenever a rate column is assigned
+    _RATE_CACHE_KEYS = (
+        'has_buying_range', 'has_selling_range', 'has_exchange_rates',
+        'buying_rate_display', 'selling_rate_display',
+        'buying_from_aed_display', 'selling_from_aed_display',
+    )
+
+    def invalidate_rate_cache(self):
+        """Drop memoized rate properties so they are recomputed on next access"""
+        for key in self._RATE_CACHE_KEYS:
+            self.__dict__.pop(key, None)
+
+def _invalidate_currency_rate_cache(target, value, oldvalue, initiator):
+    target.invalidate_rate_cache()
+
+for _rate_column in (Currency.min_buying_rate_to_aed, Currency.max_buying_rate_to_aed,
+                     Currency.min_selling_rate_to_aed, Currency.max_selling_rate_to_aed):
+    db.event.listen(_rate_column, 'set', _invalidate_currency_rate_cache)
+
+@db.event.listens_for(Currency, 'expire')
+@db.event.listens_for(Currency, 'refresh')
+def _invalidate_currency_rate_cache_on_reload(target, *args):
+    target.invalidate_rate_cache()
+
 class NoteImage(db.Model):
     __tablename__ = 'note_images'
     
@@ -218,16 +353,7 @@ class NoteImage(db.Model):
     delete_reason = db.Column(db.Text, nullable=True)
     
     # Relationship - show all images, filtering handled in queries
-    currency = db.relationship('Currency', backref=db.backref('images',
-                                                             lazy='dynamic',
-                                                             cascade='all, delete-orphan'))
-    
-    # Relationship for non-deleted images only (viewonly to avoid conflicts)
-    currency_active = db.relationship('Currency', backref=db.backref('active_images',
-                                                                    lazy='dynamic',
-                                                                    primaryjoin="and_(NoteImage.currency_id==Currency.id, NoteImage.deleted_at==None)",
-                                                                    viewonly=True,
-                                                                    overlaps="currency,images"))
+    currency = db.relationship('Currency', back_populates='images')
     
     @property
     def is_deleted(self):
@@ -261,7 +387,7 @@ class CurrencyHistory(db.Model):
     change_reason = db.Column(db.Text, nullable=True)
     
     # Relationship
-    currency = db.relationship('Currency', backref=db.backref('history', lazy=True, order_by='CurrencyHistory.created_at.desc()'))
+    currency = db.relationship('Currency', back_populates='history')
     
     def __repr__(self):
         return f'<CurrencyHistory {self.symbol} - {self.change_type} at {self.created_at}>'
@@ -282,11 +408,69 @@ class NoteHistory(db.Model):
     action_reason = db.Column(db.Text, nullable=True)
     
     # Relationship
-    currency = db.relationship('Currency', backref=db.backref('note_history', lazy=True, order_by='NoteHistory.created_at.desc()'))
+    currency = db.relationship('Currency', back_populates='note_history')
     
     def __repr__(self):
         return f'<NoteHistory {self.note_type} - {self.action_type} for {self.currency.symbol}>'
 
+# Currency data versioning used to cache pages built from currency data.
+# The version is the identity of a stamp file that is atomically replaced on
+# every commit touching currencies or images, so all gunicorn workers see it.
+CURRENCY_VERSION_FILE = os.path.join(app.instance_path, 'currency_data.version')
+os.makedirs(app.instance_path, exist_ok=True)
+
+def get_currency_data_version():
+    """Get an opaque token that changes whenever currency data is committed"""
+    try:
+        stat = os.stat(CURRENCY_VERSION_FILE)
+        return (stat.st_ino, stat.st_mtime_ns)
+    except OSError:
+        return None
+
+def bump_currency_data_version():
+    """Mark currency data as changed for every worker process"""
+    tmp_path = f"{CURRENCY_VERSION_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, CURRENCY_VERSION_FILE)
+    except OSError as e:
+        print(f"Error updating currency data version: {e}")
+
+def get_currency_data_etag(version):
+    """Get an ETag value for responses built only from the given currency data version"""
+    if version is None:
+        return None
+    return '%x-%x' % version
+
+# Bump on every start: a deploy can change the rendered pages and JSON without
+# touching currency data, so responses cached against the old version must miss
+bump_currency_data_version()
+
+@db.event.listens_for(db.session, 'after_flush')
+def _track_currency_data_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Currency, NoteImage)):
+            session.info['currency_data_changed'] = True
+            return
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def _track_currency_bulk_changes(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements bypass the flush, so check them here
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (Currency, NoteImage):
+            orm_execute_state.session.info['currency_data_changed'] = True
+
+@db.event.listens_for(db.session, 'after_commit')
+def _publish_currency_data_changes(session):
+    if session.info.pop('currency_data_changed', False):
+        bump_currency_data_version()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _discard_currency_data_changes(session):
+    session.info.pop('currency_data_changed', None)
+
 # Historical tracking functions
 def create_currency_history_record(currency, change_type='update', created_by=None, change_reason=None):
     """Create a historical record of currency changes"""
@@ -340,20 +524,94 @@ def get_current_user():
     except:
         return 'system'
 
+# Built once; SQLAlchemy's compiled cache then reuses its SQL on every call.
+# raiseload makes any relationship a list page touches without eager loading
+# fail loudly instead of issuing one SELECT per row while the template renders
+# (lookups answered from the identity map still work); callers opt relationships
+# back in with selectinload. The dynamic images relationships are query objects
+# and are not affected. Each row also carries its active image count, computed
+# in the same statement.
+ACTIVE_IMAGE_COUNT = (
+    db.select(db.func.count(NoteImage.id))
+    .where(NoteImage.currency_id == Currency.id, NoteImage.deleted_at.is_(None))
+    .correlate_except(NoteImage)
+    .scalar_subquery()
+)
+LATEST_ACTIVE_IMAGE_UPLOAD = (
+    db.select(db.func.max(NoteImage.uploaded_at))
+    .where(NoteImage.currency_id == Currency.id, NoteImage.deleted_at.is_(None))
+    .correlate_except(NoteImage)
+    .scalar_subquery()
+)
+CURRENCIES_BY_SYMBOL_QUERY = (
+    db.select(Currency)
+    .options(raiseload('*', sql_only=True), db.with_expression(Currency.active_image_count, ACTIVE_IMAGE_COUNT))
+    .order_by(Currency.symbol.asc())
+)
+
+def get_currencies_by_symbol(*options):
+    """Get all currencies ordered by symbol, applying optional loader options"""
+    query = CURRENCIES_BY_SYMBOL_QUERY
+    if options:
+        query = query.options(*options)
+    return db.session.scalars(query).all()
+
+def get_dashboard_currencies():
+    """Get currencies with everything dashboard.html reads from each row"""
+    # The dashboard shows each currency's latest note time and attached images
+    return get_currencies_by_symbol(
+        db.with_expression(Currency.latest_image_uploaded_at, LATEST_ACTIVE_IMAGE_UPLOAD),
+        selectinload(Currency.images)
+    )
+
+def parse_rate_range(form, rate_type):
+    """
+    Parse the min/max rate pair for 'buying' or 'selling' from form data
+    Returns tuple (min_rate, max_rate), or (None, None) if either field is empty
+    Raises ValueError with a user-facing message if the range is invalid
+    """
+    min_value = form.get(f'min_{rate_type}_rate_to_aed')
+    max_value = form.get(f'max_{rate_type}_rate_to_aed')
+    if not (min_value and max_value):
+        return None, None
+    
+    try:
+        min_rate = float(min_value)
+        max_rate = float(max_value)
+    except ValueError:
+        raise ValueError(f'{rate_type.capitalize()} rates must be valid numbers')
+    # float() accepts 'nan' and 'inf', which would slip past the comparison below
+    if not (math.isfinite(min_rate) and math.isfinite(max_rate)):
+        raise ValueError(f'{rate_type.capitalize()} rates must be valid numbers')
+    
+    if min_rate >= max_rate:
+        raise ValueError(f'Minimum {rate_type} rate must be less than maximum {rate_type} rate')
+    return min_rate, max_rate
+
 # Utility functions for image processing
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return filename.lower().endswith(ALLOWED_IMAGE_SUFFIXES)
+
+# Encoder settings for stored note images: progressive scans are usually a little
+# smaller than baseline JPEG and render incrementally; 4:2:0 chroma subsampling
+# is pinned so it does not depend on the encoder's defaults
+JPEG_SAVE_OPTIONS = {'format': 'JPEG', 'optimize': True, 'progressive': True, 'subsampling': 2}
 
-def compress_image(image_data, max_size_mb=10, quality=85):
+def compress_image(image_file, max_size_mb=10, quality=85):
     """
     Compress image without losing quality significantly
+    Accepts a binary file object (e.g. an upload stream)
     Returns compressed image data as bytes
     """
     try:
-        # Open image from bytes
-        image = Image.open(io.BytesIO(image_data))
+        # Open image straight from the file object instead of a copy in memory
+        image = Image.open(image_file)
+        
+        # For JPEG sources, let the decoder downscale in the DCT domain while
+        # decoding; very large photos are never decoded at full resolution.
+        # draft() keeps both sides at or above the requested size.
+        image.draft('RGB', (2048, 2048))
         
         # Convert to RGB if necessary (for JPEG compatibility)
         if image.mode in ('RGBA', 'P'):
@@ -370,30 +628,24 @@ def compress_image(image_data, max_size_mb=10, quality=85):
         
         # If image is already small enough, try with high quality first
         output = io.BytesIO()
-        image.save(output, format='JPEG', quality=quality, optimize=True)
+        image.save(output, quality=quality, **JPEG_SAVE_OPTIONS)
         
-        # If still too large, progressively reduce dimensions
-        while output.tell() > max_size_bytes and (width > 800 or height > 800):
-            # Reduce dimensions by 10%
-            width = int(width * 0.9)
-            height = int(height * 0.9)
+        # If still too large, resize once: JPEG size grows roughly with pixel count,
+        # so scale both sides by the square root of the size ratio (with a little
+        # headroom) instead of shrinking 10% and re-encoding until it fits
+        if output.tell() > max_size_bytes and (width > 800 or height > 800):
+            scale = max((max_size_bytes / output.tell()) ** 0.5 * 0.95, 800 / max(width, height))
+            width = int(width * scale)
+            height = int(height * scale)
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
             
-            # Resize image
-            resized_image = image.resize((width, height), Image.Resampling.LANCZOS)
-            
-            # Save with current quality
             output = io.BytesIO()
-            resized_image.save(output, format='JPEG', quality=quality, optimize=True)
+            image.save(output, quality=quality, **JPEG_SAVE_OPTIONS)
         
-        # If still too large, reduce quality
-        while output.tell() > max_size_bytes and quality > 50:
-            quality -= 5
+        # If still too large, step the quality down once (not below 50)
+        if output.tell() > max_size_bytes and quality > 50:
             output = io.BytesIO()
-            if width != image.size[0] or height != image.size[1]:
-                resized_image = image.resize((width, height), Image.Resampling.LANCZOS)
-                resized_image.save(output, format='JPEG', quality=quality, optimize=True)
-            else:
-                image.save(output, format='JPEG', quality=quality, optimize=True)
+            image.save(output, quality=max(quality - 10, 50), **JPEG_SAVE_OPTIONS)
         
         output.seek(0)
         return output.getvalue()
@@ -402,24 +654,25 @@ def compress_image(image_data, max_size_mb=10, quality=85):
         print(f"Error compressing image: {e}")
         return None
 
-def save_uploaded_image(file, currency_id, caption=None):
+def process_uploaded_image(file):
     """
-    Save uploaded image with compression
-    Returns tuple (success, filename_or_error_message)
+    Validate, compress and store an uploaded image file
+    Touches no database state, so it can run on IMAGE_EXECUTOR threads
+    Returns tuple (success, (filename, file_size, mime_type) or error message)
     """
     try:
         if not file or not allowed_file(file.filename):
             return False, "Invalid file type. Allowed types: PNG, JPG, JPEG, GIF, WEBP"
         
-        # Read file data
-        file_data = file.read()
-        
-        # Check file size (10MB limit)
-        if len(file_data) > app.config['MAX_CONTENT_LENGTH']:
+        # Check file size (10MB limit) without reading the upload into memory
+        file.stream.seek(0, os.SEEK_END)
+        file_size = file.stream.tell()
+        file.stream.seek(0)
+        if file_size > app.config['MAX_CONTENT_LENGTH']:
             return False, "File size exceeds 10MB limit"
         
         # Compress image
-        compressed_data = compress_image(file_data)
+        compressed_data = compress_image(file.stream)
         if compressed_data is None:
             return False, "Failed to process image"
         
@@ -432,42 +685,95 @@ def save_uploaded_image(file, currency_id, caption=None):
         with open(file_path, 'wb') as f:
             f.write(compressed_data)
         
-        # Save to database
-        note_image = NoteImage(
-            currency_id=currency_id,
-            filename=unique_filename,
-            original_filename=file.filename,
-            file_size=len(compressed_data),
-            mime_type=file.content_type or f'image/{file_extension}',
-            caption=caption
-        )
-        db.session.add(note_image)
-        db.session.commit()
-        
-        # Create note history record
-        create_note_history_record(
-            currency_id,
-            note_type='image',
-            action_type='created',
-            created_by=get_current_user(),
-            action_reason='Image uploaded',
-            image_filename=unique_filename,
-            image_original_filename=file.filename,
-            image_caption=caption
-        )
-        
-        return True, unique_filename
+        return True, (unique_filename, len(compressed_data), file.content_type or f'image/{file_extension}')
         
     except Exception as e:
         print(f"Error saving image: {e}")
         return False, f"Error saving image: {str(e)}"
 
+def record_uploaded_image(file, currency_id, caption, stored_image):
+    """Add the NoteImage row and note history for an image stored by process_uploaded_image"""
+    unique_filename, file_size, mime_type = stored_image
+    
+    # Save to database
+    note_image = NoteImage(
+        currency_id=currency_id,
+        filename=unique_filename,
+        original_filename=file.filename,
+        file_size=file_size,
+        mime_type=mime_type,
+        caption=caption
+    )
+    db.session.add(note_image)
+    
+    # Create note history record
+    create_note_history_record(
+        currency_id,
+        note_type='image',
+        action_type='created',
+        created_by=get_current_user(),
+        action_reason='Image uploaded',
+        image_filename=unique_filename,
+        image_original_filename=file.filename,
+        image_caption=caption
+    )
+
+def save_uploaded_image(file, currency_id, caption=None):
+    """
+    Save uploaded image with compression
+    Returns tuple (success, filename_or_error_message)
+    """
+    success, result = process_uploaded_image(file)
+    if not success:
+        return False, result
+    
+    try:
+        record_uploaded_image(file, currency_id, caption, result)
+        db.session.commit()
+        return True, result[0]
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error saving image: {e}")
+        return False, f"Error saving image: {str(e)}"
+
+# Compression is CPU-bound and Pillow releases the GIL while decoding, resizing
+# and encoding, so multi-image uploads compress their files in parallel
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+
+def save_uploaded_images(uploads, currency_id):
+    """
+    Save several (file, caption) uploads, compressing them concurrently
+    Returns a list of (file, caption, success, filename_or_error_message) in upload order
+    """
+    processed = IMAGE_EXECUTOR.map(process_uploaded_image, [file for file, caption in uploads])
+    
+    # Database work stays on the request thread, which owns the session; every
+    # stored image is recorded in a single transaction
+    results = []
+    for (file, caption), (success, result) in zip(uploads, processed):
+        if success:
+            record_uploaded_image(file, currency_id, caption, result)
+            result = result[0]
+        results.append((file, caption, success, result))
+    
+    if any(success for file, caption, success, result in results):
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving images: {e}")
+            results = [
+                (file, caption, False, f"Error saving image: {str(e)}") if success else (file, caption, success, result)
+                for file, caption, success, result in results
+            ]
+    return results
+
 # Image handling routes
 @app.route('/upload_image/<int:currency_id>', methods=['POST'])
 @login_required
 def upload_image(currency_id):
     """Upload an image for a currency's notes"""
-    currency = Currency.query.get_or_404(currency_id)
+    currency = db.get_or_404(Currency, currency_id)
     
     if 'image' not in request.files:
         return jsonify({'success': False, 'error': 'No image file provided'}), 400
@@ -494,7 +800,7 @@ def upload_image(currency_id):
 @login_required
 def upload_multiple_images(currency_id):
     """Upload multiple images for a currency's notes"""
-    currency = Currency.query.get_or_404(currency_id)
+    currency = db.get_or_404(Currency, currency_id)
     
     if 'images' not in request.files:
         return jsonify({'success': False, 'error': 'No image files provided'}), 400
@@ -506,16 +812,14 @@ def upload_multiple_images(currency_id):
     uploaded_files = []
     errors = []
     
-    for i, file in enumerate(files):
-        if file.filename == '':
-            continue
-            
-        # Get caption for this specific image if provided
-        caption_key = f'caption_{i}'
-        caption = request.form.get(caption_key, '').strip() or None
-        
-        success, result = save_uploaded_image(file, currency_id, caption)
-        
+    # Get caption for each specific image if provided
+    uploads = [
+        (file, request.form.get(f'caption_{i}', '').strip() or None)
+        for i, file in enumerate(files)
+        if file.filename != ''
+    ]
+    
+    for file, caption, success, result in save_uploaded_images(uploads, currency_id):
         if success:
             uploaded_files.append({
                 'filename': result,
@@ -546,7 +850,7 @@ def upload_multiple_images(currency_id):
 @login_required
 def delete_image(image_id):
     """Soft delete an uploaded image"""
-    image = NoteImage.query.get_or_404(image_id)
+    image = db.get_or_404(NoteImage, image_id)
     currency_id = image.currency_id
     
     try:
@@ -587,38 +891,75 @@ def delete_image(image_id):
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     """Serve uploaded images"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if UPLOADS_X_ACCEL_PREFIX:
+        response = make_response('')
+        # Let nginx pick the Content-Type from the file it serves
+        del response.headers['Content-Type']
+    else:
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Stored filenames are UUIDs and never rewritten, so the name is a stable
+    # validator and browsers can keep the bytes for good
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    response.set_etag(filename)
+    response = response.make_conditional(request)
+    # Only hand off to nginx for a full response; it would follow the header
+    # on a 304 and send the file anyway
+    if UPLOADS_X_ACCEL_PREFIX and response.status_code == 200:
+        response.headers['X-Accel-Redirect'] = UPLOADS_X_ACCEL_PREFIX + secure_filename(filename)
+    return response
 
 @app.route('/favicon.ico')
 def favicon():
     """Serve favicon.ico"""
     return send_from_directory(os.path.join(app.root_path, 'static'), 'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
+# Last rendered public rates page (plain and gzip-compressed) and the currency
+# data version it was built from
+_public_rates_cache = {'version': None, 'html': None, 'gzip': None}
+_public_rates_lock = threading.Lock()
+
+def _public_rates_response(response, etag):
+    """Add caching headers shared by full and 304 public page responses"""
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age=5'
+    if etag:
+        response.set_etag(etag)
+    return response
+
 @app.route('/')
 def index():
-    currencies_db = Currency.query.order_by(Currency.symbol.asc()).all()
-    currencies = [
-        {
-            'id': c.id,
-            'name': c.name,
-            'symbol': c.symbol,
-            'min_buying_rate_to_aed': c.min_buying_rate_to_aed,
-            'max_buying_rate_to_aed': c.max_buying_rate_to_aed,
-            'min_selling_rate_to_aed': c.min_selling_rate_to_aed,
-            'max_selling_rate_to_aed': c.max_selling_rate_to_aed,
-            'admin_notes': c.admin_notes,
-            'has_notes': c.has_notes,  # Now includes both text and image notes
-            'has_exchange_rates': c.has_exchange_rates,
-            'has_buying_range': c.has_buying_range,
-            'has_selling_range': c.has_selling_range,
-            'buying_rate_display': c.buying_rate_display,
-            'selling_rate_display': c.selling_rate_display,
-            'buying_from_aed_display': c.buying_from_aed_display,
-            'selling_from_aed_display': c.selling_from_aed_display
-        }
-        for c in currencies_db
-    ]
-    return render_template('public_rates.html', currencies=currencies, currencies_db=currencies_db)
+    version = get_currency_data_version()
+    use_gzip = request.accept_encodings.quality('gzip') > 0
+    
+    # Browsers that already hold this version of the page get an empty 304
+    etag = get_currency_data_etag(version)
+    if etag:
+        if use_gzip:
+            etag += '-gz'
+        if request.if_none_match.contains(etag):
+            return _public_rates_response(make_response('', 304), etag)
+    
+    # The public page only depends on currency data, so serve the last render
+    # until an admin commits a change
+    if version is None or _public_rates_cache['version'] != version:
+        # Only one thread rebuilds; others waiting on the lock reuse its result
+        with _public_rates_lock:
+            if version is None or _public_rates_cache['version'] != version:
+                # Pass ORM objects straight to the template; the display properties
+                # are read directly by Jinja so no per-request dict rebuild is needed
+                currencies = get_currencies_by_symbol()
+                html = render_template('public_rates.html', currencies=currencies).encode('utf-8')
+                _public_rates_cache.update(version=version, html=html, gzip=gzip.compress(html, 6))
+    
+    if use_gzip:
+        response = make_response(_public_rates_cache['gzip'])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = make_response(_public_rates_cache['html'])
+    return _public_rates_response(response, etag)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -626,10 +967,20 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        admin_user = AdminUser.query.filter_by(username=username).first()
+        # Only the id and hash are needed to verify; the full row is loaded on rehash
+        row = db.session.execute(
+            db.select(AdminUser.id, AdminUser.password_hash).where(AdminUser.username == username)
+        ).first()
         
-        if admin_user and admin_user.check_password(password):
-            user = User(admin_user.username)
+        password_hash = row.password_hash if row else DUMMY_PASSWORD_HASH
+        if check_password_hash(password_hash, password) and row:
+            # Upgrade hashes created with older parameters while the password is known
+            if AdminUser.password_needs_rehash(password_hash):
+                db.session.get(AdminUser, row.id).set_password(password)
+                db.session.commit()
+            # The row was just confirmed, so the next requests can skip load_user's SELECT
+            cache_admin_username(username)
+            user = User(username)
             login_user(user)
             return redirect(url_for('dashboard'))
         else:
@@ -640,29 +991,38 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    _admin_username_cache.pop(current_user.username, None)
     logout_user()
     return redirect(url_for('login'))
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    currencies = Currency.query.order_by(Currency.symbol.asc()).all()
-    # Get form data from session if there was an error
-    form_data = session.pop('form_data', {})
-    return render_template('dashboard.html', currencies=currencies, form_data=form_data)
+    currencies = get_dashboard_currencies()
+    return render_template('dashboard.html', currencies=currencies, form_data={})
 
 @app.route('/history')
 @login_required
 def history_dashboard():
     """Admin dashboard for viewing historical data"""
     # Get currency history (latest 50 records)
-    currency_history = CurrencyHistory.query.order_by(CurrencyHistory.created_at.desc()).limit(50).all()
+    currency_history = db.session.scalars(
+        db.select(CurrencyHistory).order_by(CurrencyHistory.created_at.desc()).limit(50)
+    ).all()
     
     # Get note history (latest 50 records)
-    note_history = NoteHistory.query.order_by(NoteHistory.created_at.desc()).limit(50).all()
-    
-    # Get all currencies for filtering
-    currencies = Currency.query.order_by(Currency.symbol.asc()).all()
+    # (with each record's currency, which the template shows)
+    note_history = db.session.scalars(
+        db.select(NoteHistory).options(selectinload(NoteHistory.currency))
+        .order_by(NoteHistory.created_at.desc()).limit(50)
+    ).all()
+    
+    # Get all currencies for filtering; the template counts each currency's
+    # history, so load those collections in two queries instead of two per currency
+    currencies = get_currencies_by_symbol(
+        selectinload(Currency.history),
+        selectinload(Currency.note_history)
+    )
     
     return render_template('history_dashboard.html',
                          currency_history=currency_history,
@@ -673,89 +1033,64 @@ def history_dashboard():
 @login_required
 def currency_history(currency_id):
     """Get historical data for a specific currency"""
-    currency = Currency.query.get_or_404(currency_id)
+    currency = db.get_or_404(Currency, currency_id)
     
     # Get currency change history
-    currency_changes = CurrencyHistory.query.filter_by(currency_id=currency_id)\
-                                           .order_by(CurrencyHistory.created_at.desc()).all()
+    currency_changes = db.session.scalars(
+        db.select(CurrencyHistory).where(CurrencyHistory.currency_id == currency_id)
+        .order_by(CurrencyHistory.created_at.desc())
+    ).all()
     
     # Get note history for this currency
-    note_changes = NoteHistory.query.filter_by(currency_id=currency_id)\
-                                   .order_by(NoteHistory.created_at.desc()).all()
+    note_changes = db.session.scalars(
+        db.select(NoteHistory).where(NoteHistory.currency_id == currency_id)
+        .order_by(NoteHistory.created_at.desc())
+    ).all()
     
     return render_template('currency_history.html',
                          currency=currency,
                          currency_changes=currency_changes,
                          note_changes=note_changes)
 
+# Fields echoed back into the add currency form after a failed submit
+ADD_CURRENCY_FORM_FIELDS = (
+    'name', 'symbol', 'min_buying_rate_to_aed', 'max_buying_rate_to_aed',
+    'min_selling_rate_to_aed', 'max_selling_rate_to_aed', 'admin_notes',
+)
+
+def render_add_currency_error(message, form):
+    """Re-render the dashboard with an error and the submitted values"""
+    # The dashboard submits this form by XHR and keeps the entered values in
+    # place, so it only needs the message
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return jsonify({'success': False, 'error': message}), 400
+    # Rendering directly avoids carrying the values through the session cookie
+    # and a redirect
+    flash(message, 'error')
+    form_data = {field: form.get(field, '') for field in ADD_CURRENCY_FORM_FIELDS}
+    form_data['symbol'] = form_data['symbol'].upper()
+    form_data['admin_notes'] = form_data['admin_notes'].strip()
+    return render_template('dashboard.html', currencies=get_dashboard_currencies(), form_data=form_data), 400
+
 @app.route('/add_currency', methods=['POST'])
 @login_required
 def add_currency():
-    name = request.form['name']
-    symbol = request.form['symbol'].upper()
-    admin_notes = request.form.get('admin_notes', '').strip()
-    
-    # Handle buying rate range
-    min_buying_rate = None
-    max_buying_rate = None
-    if request.form.get('min_buying_rate_to_aed') and request.form.get('max_buying_rate_to_aed'):
-        min_buying_rate = float(request.form['min_buying_rate_to_aed'])
-        max_buying_rate = float(request.form['max_buying_rate_to_aed'])
-        
-        if min_buying_rate >= max_buying_rate:
-            flash('Minimum buying rate must be less than maximum buying rate', 'error')
-            # Store form data in session for persistence
-            session['form_data'] = {
-                'name': name,
-                'symbol': symbol,
-                'min_buying_rate_to_aed': request.form.get('min_buying_rate_to_aed'),
-                'max_buying_rate_to_aed': request.form.get('max_buying_rate_to_aed'),
-                'min_selling_rate_to_aed': request.form.get('min_selling_rate_to_aed'),
-                'max_selling_rate_to_aed': request.form.get('max_selling_rate_to_aed'),
-                'admin_notes': admin_notes
-            }
-            return redirect(url_for('dashboard'))
+    # Resolve the request proxy once; every field below is read from this local
+    form = request.form
+    name = form['name']
+    symbol = form['symbol'].upper()
+    admin_notes = form.get('admin_notes', '').strip()
     
-    # Handle selling rate range
-    min_selling_rate = None
-    max_selling_rate = None
-    if request.form.get('min_selling_rate_to_aed') and request.form.get('max_selling_rate_to_aed'):
-        min_selling_rate = float(request.form['min_selling_rate_to_aed'])
-        max_selling_rate = float(request.form['max_selling_rate_to_aed'])
-        
-        if min_selling_rate >= max_selling_rate:
-            flash('Minimum selling rate must be less than maximum selling rate', 'error')
-            # Store form data in session for persistence
-            session['form_data'] = {
-                'name': name,
-                'symbol': symbol,
-                'min_buying_rate_to_aed': request.form.get('min_buying_rate_to_aed'),
-                'max_buying_rate_to_aed': request.form.get('max_buying_rate_to_aed'),
-                'min_selling_rate_to_aed': request.form.get('min_selling_rate_to_aed'),
-                'max_selling_rate_to_aed': request.form.get('max_selling_rate_to_aed'),
-                'admin_notes': admin_notes
-            }
-            return redirect(url_for('dashboard'))
+    # Handle buying and selling rate ranges
+    try:
+        min_buying_rate, max_buying_rate = parse_rate_range(form, 'buying')
+        min_selling_rate, max_selling_rate = parse_rate_range(form, 'selling')
+    except ValueError as e:
+        return render_add_currency_error(str(e), form)
     
     # Remove strict validation - allow overlapping rates
     # Users can now set overlapping buying and selling rates if needed
     
-    # Check if currency symbol already exists
-    existing = Currency.query.filter_by(symbol=symbol).first()
-    if existing:
-        flash(f'Currency with symbol {symbol} already exists', 'error')
-        # Store form data in session for persistence
-        session['form_data'] = {
-            'name': name,
-            'symbol': symbol,
-            'min_buying_rate_to_aed': request.form.get('min_buying_rate_to_aed'),
-            'max_buying_rate_to_aed': request.form.get('max_buying_rate_to_aed'),
-            'min_selling_rate_to_aed': request.form.get('min_selling_rate_to_aed'),
-            'max_selling_rate_to_aed': request.form.get('max_selling_rate_to_aed'),
-            'admin_notes': admin_notes
-        }
-        return redirect(url_for('dashboard'))
-    
     currency = Currency(
         name=name,
         symbol=symbol,
@@ -767,7 +1102,17 @@ def add_currency():
         notes_updated_at=datetime.now(timezone.utc) if admin_notes else None
     )
     db.session.add(currency)
-    db.session.commit()
+    try:
+        # The unique constraint on symbol rejects duplicates without a pre-check SELECT;
+        # flushing also assigns the id the history records below need
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        # Only look the symbol up on failure, to tell a duplicate apart from
+        # the other constraints (rate range checks, NOT NULL columns)
+        if db.session.execute(db.select(Currency.id).where(Currency.symbol == symbol)).first():
+            return render_add_currency_error(f'Currency with symbol {symbol} already exists', form)
+        return render_add_currency_error(f'Could not add currency {symbol}: check the rate ranges', form)
     
     # Create historical record for new currency
     create_currency_history_record(
@@ -787,6 +1132,7 @@ def add_currency():
             action_reason='Initial admin notes added',
             content=admin_notes
         )
+    db.session.commit()
     
     # Handle multiple image uploads if provided
     uploaded_images = 0
@@ -795,17 +1141,17 @@ def add_currency():
     if 'note_images' in request.files:
         files = request.files.getlist('note_images')
         
-        for i, file in enumerate(files):
-            if file and file.filename != '':
-                # Get caption for this specific image if provided
-                caption_key = f'caption_{i}'
-                caption = request.form.get(caption_key, '').strip() or None
-                
-                success, result = save_uploaded_image(file, currency.id, caption)
-                if success:
-                    uploaded_images += 1
-                else:
-                    image_errors.append(f"{file.filename}: {result}")
+        # Get caption for each specific image if provided
+        uploads = [
+            (file, form.get(f'caption_{i}', '').strip() or None)
+            for i, file in enumerate(files)
+            if file and file.filename != ''
+        ]
+        for file, caption, success, result in save_uploaded_images(uploads, currency.id):
+            if success:
+                uploaded_images += 1
+            else:
+                image_errors.append(f"{file.filename}: {result}")
     
     # Generate appropriate flash message
     if uploaded_images > 0:
@@ -823,8 +1169,9 @@ def add_currency():
 @app.route('/update_currency/<int:currency_id>', methods=['POST'])
 @login_required
 def update_currency(currency_id):
-    currency = Currency.query.get_or_404(currency_id)
-    currency.name = request.form['name']
+    currency = db.get_or_404(Currency, currency_id)
+    form = request.form
+    currency.name = form['name']
     
     # Store original values for comparison
     original_name = currency.name
@@ -835,7 +1182,7 @@ def update_currency(currency_id):
     original_notes = currency.admin_notes
     
     # Get the new admin notes
-    new_admin_notes = request.form.get('admin_notes', '').strip() or None
+    new_admin_notes = form.get('admin_notes', '').strip() or None
     
     # Check if notes have changed and update timestamp accordingly
     notes_changed = new_admin_notes != currency.admin_notes
@@ -845,52 +1192,17 @@ def update_currency(currency_id):
     else:
         currency.admin_notes = new_admin_notes
     
-    # Handle buying rate range
-    if request.form.get('min_buying_rate_to_aed') and request.form.get('max_buying_rate_to_aed'):
-        min_buying_rate = float(request.form['min_buying_rate_to_aed'])
-        max_buying_rate = float(request.form['max_buying_rate_to_aed'])
-        
-        if min_buying_rate >= max_buying_rate:
-            return jsonify({'success': False, 'error': 'Minimum buying rate must be less than maximum buying rate'})
-            
-        currency.min_buying_rate_to_aed = min_buying_rate
-        currency.max_buying_rate_to_aed = max_buying_rate
-    else:
-        currency.min_buying_rate_to_aed = None
-        currency.max_buying_rate_to_aed = None
-    
-    # Handle selling rate range
-    if request.form.get('min_selling_rate_to_aed') and request.form.get('max_selling_rate_to_aed'):
-        min_selling_rate = float(request.form['min_selling_rate_to_aed'])
-        max_selling_rate = float(request.form['max_selling_rate_to_aed'])
-        
-        if min_selling_rate >= max_selling_rate:
-            return jsonify({'success': False, 'error': 'Minimum selling rate must be less than maximum selling rate'})
-            
-        currency.min_selling_rate_to_aed = min_selling_rate
-        currency.max_selling_rate_to_aed = max_selling_rate
-    else:
-        currency.min_selling_rate_to_aed = None
-        currency.max_selling_rate_to_aed = None
-    
-    # Handle multiple image uploads if provided
-    uploaded_images = 0
-    image_errors = []
+    # Handle buying and selling rate ranges
+    try:
+        min_buying_rate, max_buying_rate = parse_rate_range(form, 'buying')
+        min_selling_rate, max_selling_rate = parse_rate_range(form, 'selling')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
     
-    if 'note_images' in request.files:
-        files = request.files.getlist('note_images')
-        
-        for i, file in enumerate(files):
-            if file and file.filename != '':
-                # Get caption for this specific image if provided
-                caption_key = f'caption_{i}'
-                caption = request.form.get(caption_key, '').strip() or None
-                
-                success, result = save_uploaded_image(file, currency.id, caption)
-                if success:
-                    uploaded_images += 1
-                else:
-                    image_errors.append(f"{file.filename}: {result}")
+    currency.min_buying_rate_to_aed = min_buying_rate
+    currency.max_buying_rate_to_aed = max_buying_rate
+    currency.min_selling_rate_to_aed = min_selling_rate
+    currency.max_selling_rate_to_aed = max_selling_rate
     
     # Check what changed for historical tracking
     changes = []
@@ -905,9 +1217,6 @@ def update_currency(currency_id):
     if currency.max_selling_rate_to_aed != original_max_selling:
         changes.append(f"Max selling rate: {original_max_selling} → {currency.max_selling_rate_to_aed}")
     
-    # Commit currency updates
-    db.session.commit()
-    
     # Create historical record if there were changes
     if changes or notes_changed:
         change_reason = "Currency updated: " + "; ".join(changes) if changes else "Admin notes updated"
@@ -930,6 +1239,29 @@ def update_currency(currency_id):
             content=new_admin_notes
         )
     
+    # Commit currency updates together with their history before the image
+    # batch, so a failed image commit cannot roll back these edits
+    db.session.commit()
+    
+    # Handle multiple image uploads if provided
+    uploaded_images = 0
+    image_errors = []
+    
+    if 'note_images' in request.files:
+        files = request.files.getlist('note_images')
+        
+        # Get caption for each specific image if provided
+        uploads = [
+            (file, form.get(f'caption_{i}', '').strip() or None)
+            for i, file in enumerate(files)
+            if file and file.filename != ''
+        ]
+        for file, caption, success, result in save_uploaded_images(uploads, currency.id):
+            if success:
+                uploaded_images += 1
+            else:
+                image_errors.append(f"{file.filename}: {result}")
+    
     # Prepare response message
     message = f'Currency {currency.symbol} updated successfully'
     if uploaded_images > 0:
@@ -967,7 +1299,7 @@ def update_currency(currency_id):
 @app.route('/delete_currency/<int:currency_id>', methods=['POST'])
 @login_required
 def delete_currency(currency_id):
-    currency = Currency.query.get_or_404(currency_id)
+    currency = db.get_or_404(Currency, currency_id)
     symbol = currency.symbol
     
     # Create historical record before deletion
@@ -979,7 +1311,7 @@ def delete_currency(currency_id):
     )
     
     # Soft delete all associated images (use all images, not just active ones)
-    for image in currency.images.all():
+    for image in currency.images:
         if not image.is_deleted:
             image.soft_delete(
                 deleted_by=get_current_user(),
@@ -1015,49 +1347,87 @@ def delete_currency(currency_id):
 
 @app.route('/buying')
 def buying():
-    currencies = Currency.query.order_by(Currency.symbol.asc()).all()
+    currencies = get_currencies_by_symbol()
     return render_template('buying.html', currencies=currencies)
 
 @app.route('/selling')
 def selling():
-    currencies = Currency.query.order_by(Currency.symbol.asc()).all()
+    currencies = get_currencies_by_symbol()
     return render_template('selling.html', currencies=currencies)
 
+# Serialized /currency_notes bodies for the current data version, keyed by currency id
+_currency_notes_cache = {'version': None, 'payloads': {}}
+
+def _currency_notes_response(response, etag):
+    """Make browsers revalidate currency notes against the data version"""
+    response.headers['Cache-Control'] = 'no-cache'
+    if etag:
+        response.set_etag(etag)
+    return response
+
 @app.route('/currency_notes/<int:currency_id>')
 def get_currency_notes(currency_id):
-    currency = Currency.query.get_or_404(currency_id)
-    
-    # Get attached images with captions (only non-deleted images)
-    images_data = []
-    for image in currency.active_images.all():
-        images_data.append({
-            'id': image.id,
-            'filename': image.filename,
-            'original_filename': image.original_filename,
-            'file_size': image.file_size,
-            'mime_type': image.mime_type,
-            'caption': image.caption,
-            'uploaded_at': image.uploaded_at.isoformat() + 'Z' if image.uploaded_at else None
-        })
+    global _currency_notes_cache
+    # Notes only change with currency data, so clients revalidate with the data version
+    version = get_currency_data_version()
+    etag = get_currency_data_etag(version)
+    # Only answer 304 once the currency is known to exist, so missing ids still 404
+    not_modified = etag and request.if_none_match.contains(etag)
+    
+    # Serve the JSON body built for this data version when one is cached
+    cache = _currency_notes_cache
+    if version is not None and cache['version'] == version and currency_id in cache['payloads']:
+        if not_modified:
+            return _currency_notes_response(make_response('', 304), etag)
+        response = app.response_class(cache['payloads'][currency_id], mimetype='application/json')
+        return _currency_notes_response(response, etag)
+    
+    currency = db.get_or_404(Currency, currency_id)
+    if not_modified:
+        return _currency_notes_response(make_response('', 304), etag)
+    
+    # Get attached images with captions (only non-deleted images, newest first)
+    # as plain mapping rows; no NoteImage objects are needed to build the JSON
+    image_rows = db.session.execute(
+        db.select(NoteImage.id, NoteImage.filename, NoteImage.original_filename,
+                  NoteImage.file_size, NoteImage.mime_type, NoteImage.caption,
+                  NoteImage.uploaded_at)
+        .where(NoteImage.currency_id == currency.id, NoteImage.deleted_at.is_(None))
+        .order_by(NoteImage.uploaded_at.desc().nulls_last())
+    ).mappings().all()
+    images_data = [
+        dict(row, uploaded_at=row['uploaded_at'].isoformat() + 'Z' if row['uploaded_at'] else None)
+        for row in image_rows
+    ]
     
-    # Sort images by upload date (newest first)
-    images_data.sort(key=lambda x: x['uploaded_at'] or '', reverse=True)
+    # Derive note flags from the images loaded above instead of the has_notes and
+    # latest_note_timestamp properties, which would each query the images again
+    timestamps = [row['uploaded_at'] for row in image_rows if row['uploaded_at']]
+    if currency.notes_updated_at:
+        timestamps.append(currency.notes_updated_at)
+    latest_note_timestamp = max(timestamps) if timestamps else None
     
-    return {
+    response = jsonify({
         'id': currency.id,
         'symbol': currency.symbol,
         'name': currency.name,
         'notes': currency.admin_notes or ('No text notes available for this currency.' if not images_data else ''),
         'notes_updated_at': currency.notes_updated_at.isoformat() + 'Z' if currency.notes_updated_at else None,
-        'has_notes': currency.has_notes,
-        'latest_note_timestamp': currency.latest_note_timestamp.isoformat() + 'Z' if currency.latest_note_timestamp else None,
+        'has_notes': bool(currency.admin_notes) or bool(image_rows),
+        'latest_note_timestamp': latest_note_timestamp.isoformat() + 'Z' if latest_note_timestamp else None,
         'has_exchange_rates': currency.has_exchange_rates,
         'buying_rate_display': currency.buying_rate_display,
         'selling_rate_display': currency.selling_rate_display,
         'buying_from_aed_display': currency.buying_from_aed_display,
         'selling_from_aed_display': currency.selling_from_aed_display,
         'images': images_data
-    }
+    })
+    if version is not None:
+        if cache['version'] != version:
+            # Swap in a fresh dict so payloads from older versions are dropped at once
+            cache = _currency_notes_cache = {'version': version, 'payloads': {}}
+        cache['payloads'][currency_id] = response.get_data()
+    return _currency_notes_response(response, etag)
 
 @app.route('/admin')
 def admin_redirect():
@@ -1065,16 +1435,24 @@ def admin_redirect():
         return redirect(url_for('dashboard'))
     return redirect(url_for('login'))
 
+# Liveness probe statement, built once instead of per request
+SELECT_ONE = text('SELECT 1')
+
 @app.route('/health')
 def health_check():
+    # Probes only need to know the database answers; the row count is opt-in
+    # via ?deep=1 so frequent liveness checks never scan the currency table
     try:
-        currency_count = Currency.query.count()
-        return {
+        response = {
             'status': 'healthy',
             'database': 'connected',
-            'currencies': currency_count,
             'version': '1.0.0'
-        }, 200
+        }
+        if request.args.get('deep') == '1':
+            response['currencies'] = db.session.scalar(db.select(db.func.count()).select_from(Currency))
+        else:
+            db.session.execute(SELECT_ONE)
+        return response, 200
     except Exception as e:
         return {
             'status': 'unhealthy',
@@ -1096,6 +1474,11 @@ if __name__ == '__main__':
     # Initialize database and run migrations
     init_db_and_migrations()
     
+    # Warm the admin username cache used by load_user
+    with app.app_context():
+        for username in db.session.scalars(db.select(AdminUser.username)):
+            cache_admin_username(username)
+    
     # Get configuration from environment
     port = int(os.environ.get('PORT', 5001))
     debug = os.environ.get('DEBUG', 'false').lower() == 'true'
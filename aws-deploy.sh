@@ -251,6 +251,12 @@ server {
         proxy_ignore_client_abort on;
     }
     
+    # Uploaded images, streamed by nginx when the app sends X-Accel-Redirect
+    location /_protected_uploads/ {
+        internal;
+        alias /opt/currency-exchange/uploads/;
+    }
+    
     # Health check endpoint
     location /health {
         access_log off;
@@ -477,6 +483,7 @@ DATABASE_URL=postgresql://$DB_USER:$DB_PASSWORD@$RDS_ENDPOINT:5432/$DB_NAME
 ADMIN_USERNAME=admin
 ADMIN_PASSWORD=$ADMIN_PASSWORD
 AWS_REGION=us-east-1
+UPLOADS_X_ACCEL_PREFIX=/_protected_uploads/
 EOF
 
     # Set secure permissions on environment file
@@ -51,6 +51,10 @@ def run_migrations():
         print("Running migration 002: Create admin user...")
         migration_002_create_admin_user()
         
+        # Migration 010: Enforce min < max rate ranges in the database
+        print("Running migration 010: Add currency rate range check constraints...")
+        migration_010_add_currency_rate_checks()
+        
         print("All migrations completed successfully")
         
         # Run historical tracking migrations
@@ -109,7 +113,9 @@ def migration_002_create_admin_user():
         raise ValueError("ADMIN_USERNAME and ADMIN_PASSWORD environment variables must be set for production deployment")
     
     # Check if admin user already exists
-    existing_admin = AdminUser.query.filter_by(username=admin_username).first()
+    existing_admin = db.session.execute(
+        db.select(AdminUser).where(AdminUser.username == admin_username)
+    ).scalar_one_or_none()
     
     if not existing_admin:
         admin_user = AdminUser(username=admin_username)
@@ -386,6 +392,42 @@ def migration_006_add_caption_to_note_images():
         print(f"Migration 006 failed: {e}")
         print("caption column will be created by SQLAlchemy if needed")
 
+def migration_010_add_currency_rate_checks():
+    """Migration 010: Add CHECK constraints for currency rate ranges"""
+    from app import db
+    
+    try:
+        inspector = db.inspect(db.engine)
+        if 'currency' not in inspector.get_table_names():
+            print("Currency table doesn't exist yet, skipping migration 010")
+            return
+        
+        existing = {check['name'] for check in inspector.get_check_constraints('currency')}
+        constraints = {
+            'ck_currency_buying_range': 'min_buying_rate_to_aed < max_buying_rate_to_aed',
+            'ck_currency_selling_range': 'min_selling_rate_to_aed < max_selling_rate_to_aed',
+        }
+        missing = {name: sql for name, sql in constraints.items() if name not in existing}
+        if not missing:
+            print("Currency rate range check constraints already exist")
+            return
+        
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.connect() as connection:
+                for name, sql in missing.items():
+                    connection.execute(text(f"ALTER TABLE currency ADD CONSTRAINT {name} CHECK ({sql});"))
+                connection.commit()
+                print(f"✅ Added currency check constraints: {list(missing)} (PostgreSQL)")
+        elif db.engine.dialect.name == 'sqlite':
+            # SQLite cannot add constraints to an existing table; new databases get
+            # them from the model and parse_rate_range validates every write
+            print("SQLite detected - check constraints apply to newly created tables only")
+        else:
+            print(f"Unknown database dialect: {db.engine.dialect.name}")
+            
+    except Exception as e:
+        print(f"Migration 010 failed: {e}")
+
 def load_sample_data(Currency=None, db=None):
     """Load sample currency data for development with admin notes"""
     if Currency is None or db is None:
@@ -396,7 +438,7 @@ def load_sample_data(Currency=None, db=None):
         print("Skipping sample data load - not in development mode")
         return
     
-    if Currency.query.count() == 0:
+    if db.session.scalar(db.select(db.func.count()).select_from(Currency)) == 0:
         from datetime import datetime, timedelta
         
         # Create timestamps for different currencies (simulating different add times)
@@ -404,56 +446,56 @@ def load_sample_data(Currency=None, db=None):
         
         sample_currencies = [
             # Currency with admin notes (will show notification indicator)
-            Currency(name='US Dollar', symbol='USD',
-                    min_buying_rate_to_aed=3.65, max_buying_rate_to_aed=3.67,
-                    min_selling_rate_to_aed=3.68, max_selling_rate_to_aed=3.70,
-                    admin_notes='⚠️ High volatility expected this week due to Federal Reserve meeting. Monitor rates closely for optimal exchange timing.',
-                    notes_updated_at=now - timedelta(minutes=30)),
+            dict(name='US Dollar', symbol='USD',
+                min_buying_rate_to_aed=3.65, max_buying_rate_to_aed=3.67,
+                min_selling_rate_to_aed=3.68, max_selling_rate_to_aed=3.70,
+                admin_notes='⚠️ High volatility expected this week due to Federal Reserve meeting. Monitor rates closely for optimal exchange timing.',
+                notes_updated_at=now - timedelta(minutes=30)),
             
             # Currency without admin notes (no notification indicator)
-            Currency(name='Euro', symbol='EUR',
-                    min_buying_rate_to_aed=3.95, max_buying_rate_to_aed=3.97,
-                    min_selling_rate_to_aed=4.00, max_selling_rate_to_aed=4.02),
+            dict(name='Euro', symbol='EUR',
+                min_buying_rate_to_aed=3.95, max_buying_rate_to_aed=3.97,
+                min_selling_rate_to_aed=4.00, max_selling_rate_to_aed=4.02),
             
             # Currency with admin notes (will show notification indicator)
-            Currency(name='British Pound', symbol='GBP',
-                    min_buying_rate_to_aed=4.50, max_buying_rate_to_aed=4.52,
-                    min_selling_rate_to_aed=4.55, max_selling_rate_to_aed=4.57,
-                    admin_notes='📈 Brexit-related fluctuations possible. Current rates are favorable for buying GBP.',
-                    notes_updated_at=now - timedelta(hours=2)),
+            dict(name='British Pound', symbol='GBP',
+                min_buying_rate_to_aed=4.50, max_buying_rate_to_aed=4.52,
+                min_selling_rate_to_aed=4.55, max_selling_rate_to_aed=4.57,
+                admin_notes='📈 Brexit-related fluctuations possible. Current rates are favorable for buying GBP.',
+                notes_updated_at=now - timedelta(hours=2)),
             
             # Currency without admin notes (no notification indicator)
-            Currency(name='Japanese Yen', symbol='JPY',
-                    min_buying_rate_to_aed=0.025, max_buying_rate_to_aed=0.027,
-                    min_selling_rate_to_aed=0.028, max_selling_rate_to_aed=0.030),
+            dict(name='Japanese Yen', symbol='JPY',
+                min_buying_rate_to_aed=0.025, max_buying_rate_to_aed=0.027,
+                min_selling_rate_to_aed=0.028, max_selling_rate_to_aed=0.030),
             
             # Currency with admin notes (will show notification indicator)
-            Currency(name='Canadian Dollar', symbol='CAD',
-                    min_buying_rate_to_aed=2.70, max_buying_rate_to_aed=2.72,
-                    min_selling_rate_to_aed=2.75, max_selling_rate_to_aed=2.77,
-                    admin_notes='🛢️ Oil price changes affecting CAD rates. Best rates available for bulk exchanges over 10,000 AED.',
-                    notes_updated_at=now - timedelta(days=1)),
+            dict(name='Canadian Dollar', symbol='CAD',
+                min_buying_rate_to_aed=2.70, max_buying_rate_to_aed=2.72,
+                min_selling_rate_to_aed=2.75, max_selling_rate_to_aed=2.77,
+                admin_notes='🛢️ Oil price changes affecting CAD rates. Best rates available for bulk exchanges over 10,000 AED.',
+                notes_updated_at=now - timedelta(days=1)),
             
             # Currency without admin notes (no notification indicator)
-            Currency(name='Swiss Franc', symbol='CHF',
-                    min_buying_rate_to_aed=4.10, max_buying_rate_to_aed=4.12,
-                    min_selling_rate_to_aed=4.15, max_selling_rate_to_aed=4.17),
+            dict(name='Swiss Franc', symbol='CHF',
+                min_buying_rate_to_aed=4.10, max_buying_rate_to_aed=4.12,
+                min_selling_rate_to_aed=4.15, max_selling_rate_to_aed=4.17),
             
             # Currency with admin notes (will show notification indicator)
-            Currency(name='Australian Dollar', symbol='AUD',
-                    min_buying_rate_to_aed=2.45, max_buying_rate_to_aed=2.47,
-                    min_selling_rate_to_aed=2.50, max_selling_rate_to_aed=2.52,
-                    admin_notes='🏦 Special promotion: 0.02 AED better rate for exchanges above 5,000 AED until end of month.',
-                    notes_updated_at=now - timedelta(days=3)),
+            dict(name='Australian Dollar', symbol='AUD',
+                min_buying_rate_to_aed=2.45, max_buying_rate_to_aed=2.47,
+                min_selling_rate_to_aed=2.50, max_selling_rate_to_aed=2.52,
+                admin_notes='🏦 Special promotion: 0.02 AED better rate for exchanges above 5,000 AED until end of month.',
+                notes_updated_at=now - timedelta(days=3)),
             
             # Currency without admin notes (no notification indicator)
-            Currency(name='Singapore Dollar', symbol='SGD',
-                    min_buying_rate_to_aed=2.68, max_buying_rate_to_aed=2.70,
-                    min_selling_rate_to_aed=2.73, max_selling_rate_to_aed=2.75),
+            dict(name='Singapore Dollar', symbol='SGD',
+                min_buying_rate_to_aed=2.68, max_buying_rate_to_aed=2.70,
+                min_selling_rate_to_aed=2.73, max_selling_rate_to_aed=2.75),
         ]
         
-        for currency in sample_currencies:
-            db.session.add(currency)
+        # Insert all rows in one executemany batch with a single commit
+        db.session.execute(db.insert(Currency), sample_currencies)
         db.session.commit()
         print("✅ Sample currency data loaded with admin notes for development testing")
         print("   - Currencies with notes (notification indicator): USD, GBP, CAD, AUD")